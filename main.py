@@ -1,15 +1,31 @@
 import os
+import sys
+import json
+import math
+import bisect
+import threading
 import ccxt
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from collections import deque
+import io
 import uuid
 # New imports for the conversion logic
 import time
 import hmac
 import hashlib
 import requests
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Optional: Parquet export, falls back to compressed NPZ when pyarrow is missing
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # Initialize Binance
 exchange = ccxt.binance({
@@ -19,6 +35,35 @@ exchange = ccxt.binance({
     'enableRateLimit': True,
 })
 
+
+class RateBudget:
+    """Spaces out calls shared across threads so they stay within a calls-per-second budget"""
+
+    def __init__(self, calls_per_second):
+        self.interval = 1 / calls_per_second
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until this caller's slot in the budget comes up"""
+        with self.lock:
+            now = time.monotonic()  # Immune to wall-clock jumps
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0, slot - now))
+
+
+# Shared budget for REST calls: ccxt's own rate limiter isn't thread-safe and the run stages
+# call the exchange concurrently, so every network call goes through exchange_call
+exchange_budget = RateBudget(calls_per_second=1000 / exchange.rateLimit)
+
+
+def exchange_call(method, *args, **kwargs):
+    """Call an exchange method once this caller's slot in the shared rate budget comes up"""
+    exchange_budget.wait()
+    return method(*args, **kwargs)
+
+
 # +++ START OF NEW CONVERSION LOGIC (from test_convert.py) +++
 BASE_URL = 'https://api.binance.com'
 headers = {
@@ -327,20 +372,23 @@ def detect_trend(ohlc_data, periods=5):
         return 'neutral'
 
 
-def calculate_pattern_score(ohlc_data):
+def calculate_pattern_score(ohlc_data, trend=None, pattern_scores=None, price_change_24h=None):
     """Calculate aggregate pattern score with all registered patterns"""
     if len(ohlc_data) < pattern_registry.get_required_candles():
         return 0.0
-    trend = detect_trend(ohlc_data)
-    pattern_scores = pattern_registry.detect_all(ohlc_data, trend)
+    if trend is None:
+        trend = detect_trend(ohlc_data)
+    if pattern_scores is None:
+        pattern_scores = pattern_registry.detect_all(ohlc_data, trend)
 
+    # Trend strength multiplier based on 24h price change
+    if price_change_24h is None:
+        price_change_24h = ((ohlc_data[-1]['close'] - ohlc_data[0]['close']) / ohlc_data[0]['close']) * 100
+    trend_strength = max(1.0, min(2.0, 1.0 + abs(price_change_24h) / 20))  # Cap at 2x for ±20% change
     score = 0.0
     for pattern in pattern_registry.patterns:
         pattern_score = pattern_scores[pattern['name']]
         if pattern_score > 0:
-            # Trend strength multiplier based on 24h price change
-            price_change_24h = ((ohlc_data[-1]['close'] - ohlc_data[0]['close']) / ohlc_data[0]['close']) * 100
-            trend_strength = max(1.0, min(2.0, 1.0 + abs(price_change_24h) / 20))  # Cap at 2x for ±20% change
             if trend == 'up' and pattern['is_bullish']:
                 score += pattern_score * trend_strength * 1.2
             elif trend == 'down' and pattern['is_bearish']:
@@ -354,25 +402,222 @@ def calculate_pattern_score(ohlc_data):
     return min(100.0, max(0.0, score * (25 / max(1, num_patterns / 10))))
 
 
+def calculate_extended_score(pattern_score, indicators):
+    """Adjust the pattern score with rolling indicators (EMA trend, RSI, volume z-score)"""
+    if not indicators:
+        return pattern_score
+    score = pattern_score
+    # EMA crossover confirms or contradicts the pattern signal
+    score *= 1.15 if indicators['ema_fast'] > indicators['ema_slow'] else 0.9
+    # Penalize overbought, reward oversold
+    rsi = indicators['rsi']
+    if rsi > 70:
+        score *= 0.8
+    elif rsi < 30:
+        score *= 1.1
+    # Unusual volume lends weight to the signal
+    if indicators['volume_z'] > 2:
+        score *= 1.1
+    return min(100.0, max(0.0, score))
+
+
+def candle_to_ohlc(candle):
+    """Convert a raw ccxt OHLCV row into the candle dict used by the pattern detectors"""
+    return {'timestamp': candle[0], 'open': float(candle[1]), 'high': float(candle[2]),
+            'low': float(candle[3]), 'close': float(candle[4]), 'volume': float(candle[5])}
+
+
+class CandleCache:
+    """Keeps recent candles per pair in memory so repeated scans only fetch what is new"""
+
+    def __init__(self, timeframe='4h', max_candles=100, warmup=60):
+        self.timeframe = timeframe
+        self.max_candles = max_candles
+        self.warmup = warmup  # Candles fetched on first sight of a pair, to warm up indicators
+        self.candles = {}
+        self.lock = threading.Lock()
+
+    def get(self, pair, limit=10):
+        """Return the last `limit` candles for a pair, fetching only candles newer than the cached ones"""
+        with self.lock:
+            cached = self.candles.get(pair, [])
+        if len(cached) >= limit:
+            # The last cached candle may still have been forming, so re-fetch from it onwards
+            ohlcv = exchange_call(exchange.fetch_ohlcv, pair, timeframe=self.timeframe, since=cached[-1]['timestamp'])
+            fresh = [candle_to_ohlc(candle) for candle in ohlcv]
+            first_fresh = fresh[0]['timestamp'] if fresh else None
+            merged = [c for c in cached if first_fresh is None or c['timestamp'] < first_fresh] + fresh
+        else:
+            ohlcv = exchange_call(exchange.fetch_ohlcv, pair, timeframe=self.timeframe,
+                                  limit=max(limit, self.warmup))
+            merged = [candle_to_ohlc(candle) for candle in ohlcv]
+        merged = merged[-self.max_candles:]
+        with self.lock:
+            self.candles[pair] = merged
+        return merged[-limit:]
+
+    def history(self, pair):
+        """Return every cached candle for a pair"""
+        with self.lock:
+            return list(self.candles.get(pair, []))
+
+    def prune(self, pairs):
+        """Drop cached candles for pairs not in `pairs` (e.g. delisted); returns the dropped pairs"""
+        keep = set(pairs)
+        with self.lock:
+            dropped = [pair for pair in self.candles if pair not in keep]
+            for pair in dropped:
+                del self.candles[pair]
+        return dropped
+
+
+# Shared candle cache, kept warm across scans when running as a service
+candle_cache = CandleCache()
+
+
+class IndicatorEngine:
+    """
+    Rolling EMA, ATR, RSI, volume z-score and windowed volume sum per pair.
+    Closed candles are folded into stored state in O(1) each; a vectorized batch pass seeds new pairs.
+    """
+
+    def __init__(self, ema_fast=9, ema_slow=21, atr_period=14, rsi_period=14, volume_period=20, volume_window=5):
+        # EMAs use 2/(n+1) smoothing, ATR and RSI use Wilder's 1/n
+        self.alpha = {'ema_fast': 2 / (ema_fast + 1), 'ema_slow': 2 / (ema_slow + 1),
+                      'atr': 1 / atr_period, 'rsi': 1 / rsi_period, 'volume': 2 / (volume_period + 1)}
+        # Closed candles in the volume sum; with the forming 4h candle this covers 24h
+        self.volume_window = volume_window
+        self.states = {}
+
+    @staticmethod
+    def values(state):
+        """Public indicator values from a state"""
+        avg_gain, avg_loss = state['avg_gain'], state['avg_loss']
+        if avg_loss > 0:
+            rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+        else:
+            rsi = 100.0 if avg_gain > 0 else 50.0
+        return {'ema_fast': state['ema_fast'], 'ema_slow': state['ema_slow'], 'atr': state['atr'],
+                'atr_pct': state['atr'] / state['close'] * 100 if state['close'] else 0.0,
+                'rsi': rsi, 'volume_z': state['volume_z'], 'volume_window_sum': state['volume_window_sum']}
+
+    def step(self, state, candle):
+        """Fold one closed candle into a state in constant time"""
+        a = self.alpha
+        close, high, low, volume = candle['close'], candle['high'], candle['low'], candle['volume']
+        prev_close = state['close']
+        state['ema_fast'] += a['ema_fast'] * (close - state['ema_fast'])
+        state['ema_slow'] += a['ema_slow'] * (close - state['ema_slow'])
+        true_range = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        state['atr'] += a['atr'] * (true_range - state['atr'])
+        change = close - prev_close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        if state['count'] == 1:
+            state['avg_gain'], state['avg_loss'] = gain, loss
+        else:
+            state['avg_gain'] += a['rsi'] * (gain - state['avg_gain'])
+            state['avg_loss'] += a['rsi'] * (loss - state['avg_loss'])
+        # z-score of this candle's volume against the average up to the previous candle
+        variance = state['volume_sq_mean'] - state['volume_mean'] ** 2
+        std = variance ** 0.5 if variance > 0 else 0.0
+        state['volume_z'] = (volume - state['volume_mean']) / std if std > 0 else 0.0
+        state['volume_mean'] += a['volume'] * (volume - state['volume_mean'])
+        state['volume_sq_mean'] += a['volume'] * (volume * volume - state['volume_sq_mean'])
+        window = state['volume_recent']
+        if len(window) == window.maxlen:
+            state['volume_window_sum'] -= window[0]
+        window.append(volume)
+        state['volume_window_sum'] += volume
+        state['close'] = close
+        state['timestamp'] = candle['timestamp']
+        state['count'] += 1
+        return state
+
+    def batch(self, ohlc_data):
+        """Vectorized indicator series over a candle history; the last row matches the incremental state"""
+        frame = pd.DataFrame(ohlc_data)
+        a = self.alpha
+        close, high, low, volume = frame['close'], frame['high'], frame['low'], frame['volume']
+        prev_close = close.shift(1)
+        true_range = pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+        change = close.diff()
+        volume_mean = volume.ewm(alpha=a['volume'], adjust=False).mean()
+        volume_sq_mean = (volume * volume).ewm(alpha=a['volume'], adjust=False).mean()
+        volume_std = np.sqrt((volume_sq_mean - volume_mean ** 2).clip(lower=0))
+        prev_mean, prev_std = volume_mean.shift(1), volume_std.shift(1)
+        volume_z = ((volume - prev_mean) / prev_std.where(prev_std > 0)).fillna(0.0)
+        return pd.DataFrame({
+            'timestamp': frame['timestamp'],
+            'close': close,
+            'ema_fast': close.ewm(alpha=a['ema_fast'], adjust=False).mean(),
+            'ema_slow': close.ewm(alpha=a['ema_slow'], adjust=False).mean(),
+            'atr': true_range.ewm(alpha=a['atr'], adjust=False).mean(),
+            'avg_gain': change.clip(lower=0).ewm(alpha=a['rsi'], adjust=False).mean().fillna(0.0),
+            'avg_loss': (-change).clip(lower=0).ewm(alpha=a['rsi'], adjust=False).mean().fillna(0.0),
+            'volume_mean': volume_mean,
+            'volume_sq_mean': volume_sq_mean,
+            'volume_z': volume_z,
+            'volume_window_sum': volume.rolling(self.volume_window, min_periods=1).sum(),
+            'count': np.arange(1, len(frame) + 1),
+        })
+
+    def seed(self, pair, ohlc_data):
+        """Build a pair's state from history in one vectorized pass"""
+        last = self.batch(ohlc_data).iloc[-1]
+        state = {key: float(last[key]) for key in last.index}
+        state['timestamp'], state['count'] = int(last['timestamp']), int(last['count'])
+        state['volume_recent'] = deque((c['volume'] for c in ohlc_data[-self.volume_window:]),
+                                       maxlen=self.volume_window)
+        self.states[pair] = state
+        return state
+
+    def update(self, pair, ohlc_data):
+        """Fold any newly closed candles into a pair's state and return its indicator values"""
+        closed = ohlc_data[:-1]  # The last candle is still forming
+        if not closed:
+            return None
+        state = self.states.get(pair)
+        if state is None or state['timestamp'] < closed[0]['timestamp']:
+            # New pair, or a gap the cached history no longer covers
+            state = self.seed(pair, closed)
+        else:
+            for candle in closed:
+                if candle['timestamp'] > state['timestamp']:
+                    self.step(state, candle)
+        return self.values(state)
+
+
+indicator_engine = IndicatorEngine()
+
+
+def build_pair_result(pair, ohlc_data, indicators=None):
+    """Score a pair from its candles and collect the fields reported for it"""
+    trend = detect_trend(ohlc_data)
+    patterns_detected = pattern_registry.detect_all(ohlc_data, trend)
+    price_change_24h = ((ohlc_data[-1]['close'] - ohlc_data[0]['close']) / ohlc_data[0]['close']) * 100
+    score = calculate_pattern_score(ohlc_data, trend, patterns_detected, price_change_24h)
+    current_price = ohlc_data[-1]['close']
+    if indicators:
+        # Rolling sum over the closed candles plus the forming one
+        volume_24h = indicators['volume_window_sum'] + ohlc_data[-1]['volume']
+    else:
+        volume_24h = sum([c['volume'] for c in ohlc_data[-6:]])
+    return {
+        'pair': pair, 'score': score, 'trend': trend, 'current_price': current_price,
+        'volume_24h': volume_24h, 'price_change_24h': price_change_24h, 'last_updated': datetime.now(),
+        'patterns_detected': patterns_detected, 'indicators': indicators,
+        'extended_score': calculate_extended_score(score, indicators)
+    }
+
+
 def analyze_single_pair(pair, limit=10):
     """Analyze a single trading pair with improved error handling"""
     try:
-        ohlcv = exchange.fetch_ohlcv(pair, timeframe='4h', limit=max(limit, pattern_registry.get_required_candles()))
-        if len(ohlcv) < pattern_registry.get_required_candles():
+        ohlc_data = candle_cache.get(pair, limit=max(limit, pattern_registry.get_required_candles()))
+        if len(ohlc_data) < pattern_registry.get_required_candles():
             return None
-        ohlc_data = [{'timestamp': candle[0], 'open': float(candle[1]), 'high': float(candle[2]),
-                      'low': float(candle[3]), 'close': float(candle[4]), 'volume': float(candle[5])}
-                     for candle in ohlcv]
-        score = calculate_pattern_score(ohlc_data)
-        trend = detect_trend(ohlc_data)
-        current_price = ohlc_data[-1]['close']
-        volume_24h = sum([c['volume'] for c in ohlc_data[-6:]])
-        price_change_24h = ((ohlc_data[-1]['close'] - ohlc_data[0]['close']) / ohlc_data[0]['close']) * 100
-        return {
-            'pair': pair, 'score': score, 'trend': trend, 'current_price': current_price,
-            'volume_24h': volume_24h, 'price_change_24h': price_change_24h, 'last_updated': datetime.now(),
-            'patterns_detected': pattern_registry.detect_all(ohlc_data, trend)
-        }
+        indicators = indicator_engine.update(pair, candle_cache.history(pair))
+        return build_pair_result(pair, ohlc_data, indicators)
     except (ccxt.NetworkError, ccxt.ExchangeError) as e:
         print(f"Error for {pair}: {e}")
         return None
@@ -380,15 +625,20 @@ def analyze_single_pair(pair, limit=10):
         return None
 
 
-def get_best_coins(top_n=10):
-    """Get best coins based on candlestick pattern analysis, only USDT pairs"""
-    print("Loading markets...")
+def get_usdt_spot_pairs():
+    """Return active USDT spot pairs, excluding stablecoin pairs"""
     markets = exchange.load_markets()
     spot_pairs = [pair for pair in markets
                   if markets[pair]['spot'] and markets[pair]['active']
                   and pair.endswith(('/USDT'))]
     excluded = ['USDT/USDT', 'USDC/USDT', 'USDT/USDC', 'USDC/USDC', 'BUSD/USDT', 'TUSD/USDT', 'DAI/USDT', 'FDUSD/USDT']
-    spot_pairs = [pair for pair in spot_pairs if pair not in excluded]
+    return [pair for pair in spot_pairs if pair not in excluded]
+
+
+def scan_usdt_pairs(skip_pairs=()):
+    """Analyze every USDT spot pair except skip_pairs and return (results, failed_pairs)"""
+    print("Loading markets...")
+    spot_pairs = [pair for pair in get_usdt_spot_pairs() if pair not in skip_pairs]
     print(f"Found {len(spot_pairs)} active USDT spot trading pairs")
     print(f"Analyzing {len(spot_pairs)} pairs for patterns...")
     results, failed_pairs = [], []
@@ -396,13 +646,34 @@ def get_best_coins(top_n=10):
         if i % 50 == 0:
             print(f"Progress: {i}/{len(spot_pairs)} pairs ({i / len(spot_pairs) * 100:.1f}%)")
         result = analyze_single_pair(pair)
-        if result and result['score'] > 0:
+        if result:
             results.append(result)
-        elif result is None:
+        else:
             failed_pairs.append(pair)
+    return results, failed_pairs
+
+
+def get_best_coins(top_n=10, export_dir=None, export_candles=False, score_key='extended_score'):
+    """
+    Get best coins based on candlestick pattern analysis, only USDT pairs.
+    Ranked by score_key: 'extended_score' (patterns adjusted by indicators) or 'score' (patterns only).
+    """
+    all_results, failed_pairs = scan_usdt_pairs()
+    return rank_scan_results(all_results, failed_pairs, top_n, export_dir, export_candles, score_key)
+
+
+def rank_scan_results(all_results, failed_pairs, top_n=10, export_dir=None, export_candles=False,
+                      score_key='extended_score'):
+    """Export a finished scan if requested, then return its top_n pairs with a signal ranked by score_key"""
+    if export_dir:
+        try:
+            export_scan_results(all_results, export_dir, include_candles=export_candles)
+        except Exception as e:
+            print(f"❌ Failed to export scan results: {e}")
+    results = [result for result in all_results if result['score'] > 0]
     print(f"\n✅ Analysis Complete! 📊 {len(results)} pairs analyzed, ❌ {len(failed_pairs)} failed, "
           f"🎯 {len([r for r in results if r['score'] > 20])} with signals")
-    results.sort(key=lambda x: x['score'], reverse=True)
+    results.sort(key=lambda x: x[score_key], reverse=True)
     return results[:top_n]
 
 
@@ -421,6 +692,10 @@ def print_analysis_results(results):
                                                                                            0) < 0 else "⚪"
         print(f"\n{i}. {result['pair']} {trend_emoji}")
         print(f"   📊 Pattern Score: {result['score']:.1f}% 🎯")
+        if result.get('indicators'):
+            ind = result['indicators']
+            print(f"   🧮 Extended Score: {result['extended_score']:.1f}% | RSI {ind['rsi']:.1f} | "
+                  f"ATR {ind['atr_pct']:.2f}% | Vol z {ind['volume_z']:+.2f}")
         print(f"   💰 Current Price: {price_format}")
         print(f"   📈 24h Change: {result.get('price_change_24h', 0):+.2f}% {change_emoji}")
         print(f"   🔄 Trend: {result['trend'].upper()}")
@@ -448,15 +723,126 @@ def get_market_summary(results):
         f"\n🎯 PATTERN SCORES: Avg {avg_score:.1f}%, Max {max_score:.1f}%, >50% {len([r for r in results if r['score'] > 50])}, 20-50% {len([r for r in results if 20 < r['score'] <= 50])}")
 
 
+INDICATOR_COLUMNS = ('ema_fast', 'ema_slow', 'atr', 'atr_pct', 'rsi', 'volume_z')
+
+
+def build_scan_columns(results):
+    """Turn scan results into columns of numpy arrays, with patterns as a (pairs x patterns) matrix"""
+    pattern_names = [pattern['name'] for pattern in pattern_registry.patterns]
+    columns = {
+        'pair': np.array([r['pair'] for r in results], dtype=str),
+        'score': np.array([r['score'] for r in results], dtype=float),
+        'extended_score': np.array([r.get('extended_score', r['score']) for r in results], dtype=float),
+        'trend': np.array([r['trend'] for r in results], dtype=str),
+        'current_price': np.array([r['current_price'] for r in results], dtype=float),
+        'volume_24h': np.array([r['volume_24h'] for r in results], dtype=float),
+        'price_change_24h': np.array([r['price_change_24h'] for r in results], dtype=float),
+        'last_updated': np.array([r['last_updated'] for r in results], dtype='datetime64[ms]'),
+    }
+    for name in INDICATOR_COLUMNS:
+        columns[name] = np.array([r['indicators'][name] if r.get('indicators') else np.nan for r in results],
+                                 dtype=float)
+    pattern_scores = np.array([[r['patterns_detected'].get(name, 0.0) for name in pattern_names] for r in results],
+                              dtype=float).reshape(len(results), len(pattern_names))
+    return columns, pattern_names, pattern_scores
+
+
+DEFAULT_EXPORT_DIR = '~/aicryptogainer/scan_exports'  # Outside the checkout, which CI cleans on every run
+
+
+def load_candle_watermarks(candle_root):
+    """Last exported candle timestamp per pair; the leading underscore keeps dataset readers off the file"""
+    path = os.path.join(candle_root, '_watermarks.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_candle_watermarks(candle_root, watermarks):
+    """Atomically replace the watermark file"""
+    path = os.path.join(candle_root, '_watermarks.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermarks, f)
+    os.replace(path + '.tmp', path)
+
+
+def build_candle_columns(pairs, watermarks=None):
+    """
+    Long-format candle columns (one row per pair and candle) from the shared candle cache.
+    Only closed candles newer than each pair's watermark are included, so successive exports
+    never repeat a candle. Returns (columns, updated watermarks).
+    """
+    watermarks = dict(watermarks or {})
+    rows = []
+    for pair in pairs:
+        closed = candle_cache.history(pair)[:-1]  # The forming candle would change before the next export
+        new = [c for c in closed if c['timestamp'] > watermarks.get(pair, -1)]
+        if new:
+            rows.extend((pair, c) for c in new)
+            watermarks[pair] = new[-1]['timestamp']
+    columns = {'pair': np.array([pair for pair, _ in rows], dtype=str),
+               'timestamp': np.array([c['timestamp'] for _, c in rows], dtype='int64')}
+    for field in ('open', 'high', 'low', 'close', 'volume'):
+        columns[field] = np.array([c[field] for _, c in rows], dtype=float)
+    return columns, watermarks
+
+
+def export_scan_results(results, export_dir=DEFAULT_EXPORT_DIR, include_candles=False):
+    """
+    Write one run's results as columnar files under <export_dir>/scans/date=YYYY-MM-DD/ (and candles
+    under <export_dir>/candles/date=YYYY-MM-DD/). Each run adds new files to its date partition,
+    so each tree can be read as one dataset. Candle exports only add closed candles not exported before.
+    Uses Parquet when pyarrow is installed, compressed NPZ otherwise. Returns the written paths.
+    """
+    export_dir = os.path.expanduser(export_dir)
+    run_time = datetime.now()
+    partition = f"date={run_time:%Y-%m-%d}"
+    scan_dir = os.path.join(export_dir, 'scans', partition)
+    candle_root = os.path.join(export_dir, 'candles')
+    candle_dir = os.path.join(candle_root, partition)
+    os.makedirs(scan_dir, exist_ok=True)
+    run_id = f"{run_time:%H%M%S}-{uuid.uuid4().hex[:8]}"
+    columns, pattern_names, pattern_scores = build_scan_columns(results)
+    candles = None
+    if include_candles:
+        os.makedirs(candle_dir, exist_ok=True)
+        candles, watermarks = build_candle_columns([r['pair'] for r in results], load_candle_watermarks(candle_root))
+        if not len(candles['pair']):
+            candles = None
+
+    paths = []
+    if pq is not None:
+        table = dict(columns)
+        for i, name in enumerate(pattern_names):
+            table[f"pattern:{name}"] = pattern_scores[:, i]
+        paths.append(os.path.join(scan_dir, f"scan-{run_id}.parquet"))
+        pq.write_table(pa.table(table), paths[-1])
+        if candles is not None:
+            paths.append(os.path.join(candle_dir, f"candles-{run_id}.parquet"))
+            pq.write_table(pa.table(candles), paths[-1])
+    else:
+        paths.append(os.path.join(scan_dir, f"scan-{run_id}.npz"))
+        np.savez_compressed(paths[-1], pattern_names=np.array(pattern_names, dtype=str),
+                            pattern_scores=pattern_scores, **columns)
+        if candles is not None:
+            paths.append(os.path.join(candle_dir, f"candles-{run_id}.npz"))
+            np.savez_compressed(paths[-1], **candles)
+    if candles is not None:
+        save_candle_watermarks(candle_root, watermarks)
+    print(f"💾 Exported {len(results)} results to {', '.join(paths)}")
+    return paths
+
+
 def analyze_btc_detailed():
-    """Detailed analysis of BTC/USDT"""
+    """Detailed analysis of BTC/USDT; returns the analysis result (or None)"""
     print("\n" + "=" * 60)
     print("🔍 DETAILED BTC/USDT PATTERN ANALYSIS")
     print("=" * 60)
     result = analyze_single_pair('BTC/USDT', limit=10)
     if not result:
         print("Could not analyze BTC/USDT")
-        return
+        return None
     print(f"Overall Score: {result['score']:.1f}%")
     print(f"Trend: {result['trend'].upper()}")
     print(f"Current Price: ${result['current_price']:,.2f}")
@@ -464,12 +850,13 @@ def analyze_btc_detailed():
     for pattern_name, score in result['patterns_detected'].items():
         if score > 0:
             print(f"{pattern_name}: {score:.1f}")
+    return result
 
 
 def get_wallet_balances():
     """Get all non-zero balances in spot wallet"""
     try:
-        balance = exchange.fetch_balance()
+        balance = exchange_call(exchange.fetch_balance)
         non_zero_balances = {}
         if isinstance(balance, dict):
             for asset, amounts in balance.items():
@@ -484,7 +871,7 @@ def get_wallet_balances():
         print(f"Error fetching wallet balance: {e}")
         try:
             print("Trying alternative method...")
-            account = exchange.fetch_account()
+            account = exchange_call(exchange.fetch_account)
             if 'balances' in account:
                 balances = account['balances']
                 non_zero_balances = {
@@ -558,62 +945,216 @@ def buy_asset_with_usdt(pair, usdt_amount):
         return False
 
 
+def sweep_dust_to_bnb(small_balances, max_workers=8, orders_per_second=5):
+    """
+    Fallback dust sweep: check every asset against cached market limits in one pass,
+    then sell the eligible ones for BNB concurrently within the order rate budget.
+    Returns a per-asset report.
+    """
+    markets = exchange.load_markets()  # Served from ccxt's cache once loaded
+    report, eligible = {}, {}
+    for asset, amount in small_balances.items():
+        if asset in ['USDT', 'BNB']:  # Skip USDT and BNB in fallback
+            report[asset] = {'status': 'skipped', 'method': 'spot', 'amount': amount, 'reason': 'excluded asset'}
+            continue
+        pair = f"{asset}/BNB"
+        market = markets.get(pair)
+        if not market or not market.get('spot'):
+            report[asset] = {'status': 'skipped', 'method': 'spot', 'pair': pair, 'amount': amount,
+                             'reason': 'no spot market'}
+            continue
+        min_amount = market.get('limits', {}).get('amount', {}).get('min') or 0
+        if amount <= min_amount:
+            report[asset] = {'status': 'skipped', 'method': 'spot', 'pair': pair, 'amount': amount,
+                             'reason': f"below minimum amount {min_amount}"}
+            continue
+        eligible[asset] = (pair, amount)
+
+    budget = RateBudget(orders_per_second)
+
+    def sell(pair, amount):
+        budget.wait()
+        return exchange_call(exchange.create_market_sell_order, pair, amount)
+
+    if eligible:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(eligible))) as pool:
+            futures = {pool.submit(sell, pair, amount): asset for asset, (pair, amount) in eligible.items()}
+            for future in as_completed(futures):
+                asset = futures[future]
+                pair, amount = eligible[asset]
+                try:
+                    order = future.result()
+                    report[asset] = {'status': 'sold', 'method': 'spot', 'pair': pair, 'amount': amount,
+                                     'order_id': order.get('id')}
+                except Exception as e:
+                    report[asset] = {'status': 'failed', 'method': 'spot', 'pair': pair, 'amount': amount,
+                                     'reason': str(e)}
+
+    # Orders complete in any order; report in the order the balances were given
+    report = {asset: report[asset] for asset in small_balances}
+    for asset, entry in report.items():
+        if entry['status'] == 'sold':
+            print(f"✅ Fallback: Sold {entry['amount']:.6f} {asset} for BNB | Order ID: {entry['order_id']}")
+        elif entry['status'] == 'failed':
+            print(f"❌ Fallback failed for {asset}: {entry['reason']}")
+        elif entry['reason'] != 'excluded asset':
+            print(f"❌ Fallback skipped {entry['amount']:.6f} {asset}: {entry['reason']} ({entry['pair']})")
+    return report
+
+
 def convert_small_balances_to_bnb(small_balances):
-    """Convert small balances to BNB using Binance's Convert Low-Value Assets to BNB"""
+    """
+    Convert small balances to BNB using Binance's Convert Low-Value Assets to BNB,
+    falling back to a concurrent spot sweep. Returns a per-asset report:
+    {asset: {'status': 'converted' | 'sold' | 'skipped' | 'failed', 'method': 'dust' | 'spot', ...}}
+    """
     try:
         if not small_balances:
             print("No small balances to convert to BNB")
-            return False
+            return {}
         # Skip if only USDT and BNB are present as small balances
         if all(asset in ['USDT', 'BNB'] for asset in small_balances.keys()):
             print("🟡 Skipping dust conversion: Only USDT and BNB detected as small balances")
-            return False
+            return {asset: {'status': 'skipped', 'method': 'dust', 'amount': amount, 'reason': 'excluded asset'}
+                    for asset, amount in small_balances.items()}
         asset_list = ','.join(small_balances.keys())
         params = {'asset': asset_list, 'recvWindow': 5000}
-        response = exchange.fetch('sapi/v1/asset/dust', 'private', 'POST', params)
+        response = exchange_call(exchange.fetch, 'sapi/v1/asset/dust', 'private', 'POST', params)
         print(f"Debug: Dust conversion raw response={response}")  # Detailed debug
         if isinstance(response, dict) and 'result' in response and response.get('success'):
             total_bnb = 0
+            report = {}
             for result in response.get('result', []):
                 asset = result.get('fromAsset')
                 amount = result.get('amount')
                 bnb_value = result.get('transferedTotal', 0)  # Adjusted key based on Binance API
                 total_bnb += float(bnb_value) if bnb_value else 0
+                report[asset] = {'status': 'converted', 'method': 'dust', 'amount': amount, 'bnb': bnb_value}
                 print(f"✅ Converted {amount} {asset} → {bnb_value or 'negligible'} BNB")
             print(f"✅ Total BNB received: {total_bnb:.6f} BNB")
-            return True
+            for asset, amount in small_balances.items():
+                if asset not in report:
+                    report[asset] = {'status': 'skipped', 'method': 'dust', 'amount': amount,
+                                     'reason': 'not converted by dust endpoint'}
+            return report
         else:
             print(f"❌ Dust conversion failed: {response.get('msg', 'Unknown error')}")
             if response.get('code') == -2011:
                 print("🔴 Conversion skipped: Balances too low or not eligible")
-            # Fallback to spot market
-            markets = exchange.load_markets()
-            success = True
-            for asset, amount in small_balances.items():
-                if asset not in ['USDT', 'BNB']:  # Skip USDT and BNB in fallback
-                    pair = f"{asset}/BNB"
-                    if pair in markets and markets[pair]['spot']:
-                        try:
-                            if amount > markets[pair].get('limits', {}).get('amount', {}).get('min', 0):
-                                order = exchange.create_market_sell_order(pair, amount)
-                                print(f"✅ Fallback: Sold {amount:.6f} {asset} for BNB | Order ID: {order['id']}")
-                            else:
-                                print(f"❌ Fallback skipped: {amount:.6f} {asset} below minimum for {pair}")
-                        except Exception as e:
-                            print(f"❌ Fallback failed for {asset}: {e}")
-                            success = False
-                    else:
-                        print(f"❌ No spot market for {pair}")
-                        success = False
-            return success
     except Exception as e:
         print(f"❌ Failed to convert small balances to BNB: {e}")
+        return {asset: {'status': 'failed', 'method': 'dust', 'amount': amount, 'reason': str(e)}
+                for asset, amount in small_balances.items()}
+
+    # Fallback to spot market
+    try:
+        return sweep_dust_to_bnb(small_balances)
+    except Exception as e:
+        print(f"❌ Fallback dust sweep failed: {e}")
+        return {asset: {'status': 'failed', 'method': 'spot', 'amount': amount, 'reason': str(e)}
+                for asset, amount in small_balances.items()}
+
+
+def passes_indicator_filters(indicators, max_rsi=75, min_volume_z=None):
+    """Check rolling indicator values against the rebalance filters; pairs without indicators pass"""
+    if not indicators:
+        return True
+    if max_rsi is not None and indicators['rsi'] > max_rsi:
+        return False
+    if min_volume_z is not None and indicators['volume_z'] < min_volume_z:
         return False
+    return True
 
-def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_positions=5, enable_trading=False):
+
+def build_returns_matrix(pairs, lookback=30):
+    """
+    Stack log returns of the last `lookback` closed candles for each pair from the shared candle cache.
+    Rows are pairs, columns are candle times; returns a pair has no candles for are NaN.
+    """
+    histories = [candle_cache.history(pair)[:-1] for pair in pairs]  # Drop the forming candle
+    timestamps = sorted({c['timestamp'] for history in histories for c in history[-(lookback + 1):]})
+    timestamps = timestamps[-(lookback + 1):]
+    column = {ts: i for i, ts in enumerate(timestamps)}
+    closes = np.full((len(pairs), len(timestamps)), np.nan)
+    for row, history in enumerate(histories):
+        for candle in history[-(lookback + 1):]:
+            col = column.get(candle['timestamp'])
+            if col is not None:
+                closes[row, col] = candle['close']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(np.log(closes), axis=1)
+    returns[~np.isfinite(returns)] = np.nan
+    return returns
+
+
+def pairwise_correlation(returns, min_overlap=10):
+    """
+    Correlation matrix where each entry uses only the candle times both pairs have returns for.
+    Computed with a few matrix products; entries with fewer than min_overlap shared returns
+    (or zero variance) are NaN.
+    """
+    present = np.isfinite(returns).astype(float)
+    values = np.where(present > 0, returns, 0.0)
+    squares = values * values
+    shared = present @ present.T
+    sum_x = values @ present.T  # sum_x[i, j]: sum of i's returns over times shared with j
+    sum_y = sum_x.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = values @ values.T - sum_x * sum_y / shared
+        var_x = squares @ present.T - sum_x ** 2 / shared
+        var_y = var_x.T
+        correlation = cov / np.sqrt(var_x * var_y)
+    correlation[(shared < min_overlap) | ~np.isfinite(correlation)] = np.nan
+    return correlation
+
+
+def select_decorrelated_positions(opportunities, max_positions, max_correlation=0.85, lookback=30, min_overlap=10):
+    """
+    Greedily pick up to max_positions opportunities in score order, skipping any whose return
+    correlation with an already selected pick exceeds max_correlation.
+    The full correlation matrix is computed in one vectorized pass over cached candles. Candidates
+    with fewer than min_overlap returns in the cache, or too little history shared with a selected
+    pick to compare, can't be ruled out: they keep their place in score order and are logged.
+    """
+    if max_correlation is None:
+        return opportunities[:max_positions]
+    returns = build_returns_matrix([opp['pair'] for opp in opportunities], lookback)
+    correlation = pairwise_correlation(returns, min_overlap)
+    history_length = np.isfinite(returns).sum(axis=1)
+
+    selected = []
+    max_corr_to_selected = np.full(len(opportunities), -np.inf)
+    unknown_to_selected = np.zeros(len(opportunities), dtype=bool)
+    for i, opp in enumerate(opportunities):
+        if len(selected) >= max_positions:
+            break
+        if max_corr_to_selected[i] > max_correlation:
+            print(f"   ↪️  Skipping {opp['pair']}: correlation {max_corr_to_selected[i]:.2f} with a selected position")
+            continue
+        if history_length[i] < min_overlap:
+            print(f"   ℹ️  Keeping {opp['pair']} in score order: only {history_length[i]} cached returns, "
+                  f"need {min_overlap} to check correlation")
+        elif unknown_to_selected[i]:
+            print(f"   ℹ️  Keeping {opp['pair']} in score order: not enough shared history with a selected position")
+        selected.append(opp)
+        if history_length[i] >= min_overlap:
+            unknown_to_selected |= np.isnan(correlation[i])
+        max_corr_to_selected = np.fmax(max_corr_to_selected, correlation[i])
+    return selected
+
+
+def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_positions=5, enable_trading=False,
+                          max_rsi=75, min_volume_z=None, max_correlation=0.85, balances=None, tickers=None,
+                          score_key='extended_score'):
     """
     Automatically rebalance wallet based on pattern analysis.
     New logic: Utilizes the full USDT balance for diversification, allocated proportionally based on score.
+    The score used for the threshold, ranking and allocation is score_key ('extended_score' or 'score').
+    Opportunities are also filtered on rolling indicators: overbought RSI above max_rsi and, if set,
+    a volume z-score below min_volume_z are skipped.
+    Positions are picked in score order but skip coins whose returns correlate above max_correlation
+    with an already picked one (None disables this).
+    Pre-fetched balances and tickers ({pair: ticker}) can be passed in to skip fetching them here.
     """
     print("\n" + "=" * 80)
     print("🤖 AUTO WALLET REBALANCING SYSTEM (v2.0 Proportional Allocation)")
@@ -623,8 +1164,10 @@ def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_po
         print("⚠️  Set enable_trading=True to execute real trades")
 
     # Fetch current wallet balances
-    print("\n📊 Fetching current wallet balances...")
-    balances = get_wallet_balances()
+    if balances is None:
+        print("\n📊 Fetching current wallet balances...")
+        balances = get_wallet_balances()
+    tickers = tickers or {}
     if not balances:
         print("❌ Could not fetch wallet balances or wallet is empty")
         return
@@ -642,7 +1185,7 @@ def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_po
         else:
             try:
                 pair = f"{asset}/USDT"
-                ticker = exchange.fetch_ticker(pair)
+                ticker = tickers.get(pair) or exchange_call(exchange.fetch_ticker, pair)
                 usdt_value = amount * ticker['last']
                 if usdt_value < 0.5:  # Small balance threshold
                     small_balances[asset] = amount
@@ -664,20 +1207,24 @@ def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_po
 
     # Filter good opportunities
     good_opportunities = [opp for opp in top_opportunities if
-                          opp['score'] >= min_score_threshold and
+                          opp[score_key] >= min_score_threshold and
                           opp['pair'].endswith(('/USDT')) and
                           opp['trend'] in ['up', 'neutral'] and
-                          opp.get('price_change_24h', 0) > -10]
-
-    print(f"\n✨ Found {len(good_opportunities)} good opportunities (score ≥ {min_score_threshold}%):")
-    for i, opp in enumerate(good_opportunities[:max_positions], 1):
+                          opp.get('price_change_24h', 0) > -10 and
+                          passes_indicator_filters(opp.get('indicators'), max_rsi, min_volume_z)]
+    good_opportunities.sort(key=lambda opp: opp[score_key], reverse=True)
+
+    selected_opportunities = select_decorrelated_positions(good_opportunities, max_positions, max_correlation)
+    print(f"\n✨ Found {len(selected_opportunities)} good opportunities (score ≥ {min_score_threshold}%, "
+          f"{len(good_opportunities)} before diversification):")
+    for i, opp in enumerate(selected_opportunities, 1):
         trend_emoji = "📈" if opp['trend'] == 'up' else "➡️"
         change_emoji = "🟢" if opp.get('price_change_24h', 0) > 0 else "🔴"
         print(
-            f"   {i}. {opp['pair']} - Score: {opp['score']:.1f}% {trend_emoji} | 24h: {opp.get('price_change_24h', 0):+.2f}% {change_emoji}")
+            f"   {i}. {opp['pair']} - Score: {opp['score']:.1f}% (ext {opp.get('extended_score', opp['score']):.1f}%) {trend_emoji} | 24h: {opp.get('price_change_24h', 0):+.2f}% {change_emoji}")
 
     # Identify assets to keep vs. convert
-    top_assets = {opp['pair'].split('/')[0] for opp in good_opportunities[:max_positions]}
+    top_assets = {opp['pair'].split('/')[0] for opp in selected_opportunities}
     assets_to_keep = {asset for asset in balances if asset in top_assets and asset != 'USDT'}
     assets_to_convert = {asset for asset in balances if
                          asset not in top_assets and asset not in ['USDT', 'BNB'] and asset not in small_balances}
@@ -687,7 +1234,7 @@ def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_po
     print(f"🧹 Small balances to convert to BNB: {', '.join(small_balances.keys()) if small_balances else 'None'}")
 
     # Strategy decision
-    strategy = "diversify" if good_opportunities else "convert_to_usdt"
+    strategy = "diversify" if selected_opportunities else "convert_to_usdt"
     print(f"\n{'🎯' if strategy == 'diversify' else '🔄'} STRATEGY: {strategy.replace('_', ' ').title()}")
 
     if not enable_trading:
@@ -703,7 +1250,8 @@ def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_po
             if enable_trading:
                 if convert_to_usdt(asset, amount_to_convert):
                     # Fictional update of USDT balance for subsequent steps
-                    usdt_balance += amount_to_convert * exchange.fetch_ticker(f'{asset}/USDT')['last']
+                    pair = f'{asset}/USDT'
+                    usdt_balance += amount_to_convert * (tickers.get(pair) or exchange_call(exchange.fetch_ticker, pair))['last']
             else:
                 print(f"   Would convert: {amount_to_convert:.6f} {asset} → USDT")
 
@@ -711,7 +1259,9 @@ def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_po
     if small_balances:
         print("\n🧹 Converting small balances (<$0.5) to BNB...")
         if enable_trading:
-            convert_small_balances_to_bnb(small_balances)
+            dust_report = convert_small_balances_to_bnb(small_balances)
+            handled = [asset for asset, entry in dust_report.items() if entry['status'] in ('converted', 'sold')]
+            print(f"🧹 Dust handled for {len(handled)}/{len(small_balances)} assets")
         else:
             for asset, amount in small_balances.items():
                 print(f"   Would convert: {amount:.6f} {asset} → BNB")
@@ -723,19 +1273,19 @@ def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_po
             print(f"\n🎯 Diversifying {usdt_balance:.2f} USDT proportionally among top {max_positions} opportunities...")
 
             # Select assets to invest in
-            assets_to_buy = good_opportunities[:max_positions]
+            assets_to_buy = selected_opportunities
             
             # Calculate the total score of the selected assets
-            total_score = sum(opp['score'] for opp in assets_to_buy)
+            total_score = sum(opp[score_key] for opp in assets_to_buy)
             
             if total_score > 0:
                 usdt_to_allocate = usdt_balance
                 # Allocate USDT based on the score of each asset
                 for opp in assets_to_buy:
-                    proportion = opp['score'] / total_score
+                    proportion = opp[score_key] / total_score
                     usdt_amount_for_this_asset = usdt_to_allocate * proportion
                     
-                    print(f"   - Allocating to {opp['pair']}: Score {opp['score']:.1f} ({proportion:.1%}) -> ${usdt_amount_for_this_asset:.2f} USDT")
+                    print(f"   - Allocating to {opp['pair']}: Score {opp[score_key]:.1f} ({proportion:.1%}) -> ${usdt_amount_for_this_asset:.2f} USDT")
                     
                     if enable_trading:
                         buy_asset_with_usdt(opp['pair'], usdt_amount_for_this_asset)
@@ -762,29 +1312,422 @@ def auto_rebalance_wallet(existing_analysis=None, min_score_threshold=15, max_po
     print("=" * 60)
 
 
-if __name__ == "__main__":
-    if not exchange.apiKey or exchange.apiKey == os.environ['API']:
-        print("⚠️  Please set your Binance API credentials in GitHub Secrets")
-        print("⚠️  The script will try to run with public endpoints only")
+# --- SERVICE MODE: resident scanner with in-memory ranking API ---
+class RankingIndex:
+    """
+    In-memory index over the latest scan results for fast filtered ranking queries.
+    Ranking and the score range filter use score_key ('extended_score' or 'score').
+    """
+
+    def __init__(self, score_key='extended_score'):
+        self.score_key = score_key
+        self.snapshot = self._build([])
+        self.updated_at = None
+        self.cycles = 0
+
+    def _build(self, results):
+        """Precompute score order and per-trend / per-pattern position lists"""
+        ranked = sorted(results, key=lambda r: r[self.score_key], reverse=True)
+        by_trend, by_pattern = {}, {}
+        for i, result in enumerate(ranked):
+            by_trend.setdefault(result['trend'], []).append(i)
+            for name, score in result['patterns_detected'].items():
+                if score > 0:
+                    by_pattern.setdefault(name, []).append(i)
+        return {
+            'ranked': ranked,
+            'neg_scores': [-r[self.score_key] for r in ranked],  # Ascending, for bisect on the descending ranking
+            'by_trend': by_trend,
+            'by_pattern': by_pattern,
+            'by_pair': {r['pair']: r for r in ranked},
+        }
+
+    def update(self, results):
+        """Swap in a new snapshot; readers always see either the old or the new one"""
+        self.snapshot = self._build(results)
+        self.updated_at = datetime.now()
+        self.cycles += 1
+
+    def get(self, pair):
+        """Return the latest result for a single pair, or None"""
+        return self.snapshot['by_pair'].get(pair)
+
+    def query(self, pattern=None, trend=None, min_score=None, max_score=None,
+              min_volume=None, max_volume=None, limit=None):
+        """Return results in score order matching all given filters"""
+        if limit is not None and limit <= 0:
+            return []
+        snapshot = self.snapshot
+        ranked, neg_scores = snapshot['ranked'], snapshot['neg_scores']
+        lo = bisect.bisect_left(neg_scores, -max_score) if max_score is not None else 0
+        hi = bisect.bisect_right(neg_scores, -min_score) if min_score is not None else len(ranked)
+        # Walk the narrowest candidate list and check the remaining filters per entry
+        candidates = [range(lo, hi)]
+        if trend is not None:
+            candidates.append(snapshot['by_trend'].get(trend, []))
+        if pattern is not None:
+            candidates.append(snapshot['by_pattern'].get(pattern, []))
+        matches = []
+        for i in min(candidates, key=len):
+            if not lo <= i < hi:
+                continue
+            result = ranked[i]
+            if trend is not None and result['trend'] != trend:
+                continue
+            if pattern is not None and result['patterns_detected'].get(pattern, 0) <= 0:
+                continue
+            if min_volume is not None and result['volume_24h'] < min_volume:
+                continue
+            if max_volume is not None and result['volume_24h'] > max_volume:
+                continue
+            matches.append(result)
+            if limit is not None and len(matches) >= limit:
+                break
+        return matches
+
+
+class RankingRequestHandler(BaseHTTPRequestHandler):
+    """Serves /health, /ranking and /pair/<BASE>/<QUOTE> from the server's RankingIndex"""
+
+    float_params = ('min_score', 'max_score', 'min_volume', 'max_volume')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        index = self.server.ranking_index
+        if url.path == '/health':
+            self._send_json(200, {'status': 'ok', 'cycles': index.cycles, 'pairs': len(index.snapshot['ranked']),
+                                  'updated_at': index.updated_at})
+        elif url.path == '/ranking':
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            try:
+                filters = {k: float(params[k]) for k in self.float_params if k in params}
+                for k, v in filters.items():
+                    if not math.isfinite(v):
+                        raise ValueError(f"{k} must be a finite number")
+                if 'limit' in params:
+                    filters['limit'] = int(params['limit'])
+                    if filters['limit'] <= 0:
+                        raise ValueError("limit must be a positive integer")
+            except ValueError as e:
+                self._send_json(400, {'error': f"Invalid query parameter: {e}"})
+                return
+            results = index.query(pattern=params.get('pattern'), trend=params.get('trend'), **filters)
+            self._send_json(200, {'updated_at': index.updated_at, 'count': len(results), 'results': results})
+        elif url.path.startswith('/pair/'):
+            result = index.get(url.path[len('/pair/'):].upper())
+            if result:
+                self._send_json(200, result)
+            else:
+                self._send_json(404, {'error': 'Pair not found in latest scan'})
+        else:
+            self._send_json(404, {'error': 'Unknown endpoint'})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, default=lambda o: o.isoformat() if isinstance(o, datetime) else str(o)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep the scan log readable
+
+
+def run_service(host='127.0.0.1', port=8080, close_delay=30, markets_ttl=86400, export_dir=None,
+                export_candles=False):
+    """
+    Run as a long-lived service: keep the exchange session, markets and candles warm,
+    rescan shortly after every candle close and serve the latest ranking over HTTP/JSON.
+    """
+    index = RankingIndex()
+    server = ThreadingHTTPServer((host, port), RankingRequestHandler)
+    server.ranking_index = index
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🌐 Ranking API listening on http://{host}:{port}/ranking")
+
+    period = exchange.parse_timeframe(candle_cache.timeframe)
+    markets_loaded_at = 0
     try:
-        analyze_btc_detailed()
+        while True:
+            started = time.time()
+            try:
+                if started - markets_loaded_at > markets_ttl:
+                    exchange_call(exchange.load_markets, reload=True)
+                    markets_loaded_at = started
+                results, failed_pairs = scan_usdt_pairs()
+                index.update(results)
+                # Forget pairs that are no longer listed so the cache doesn't grow forever
+                listed = get_usdt_spot_pairs()
+                for pair in candle_cache.prune(listed):
+                    indicator_engine.states.pop(pair, None)
+                if export_dir:
+                    try:
+                        export_scan_results(results, export_dir, include_candles=export_candles)
+                    except Exception as e:
+                        print(f"❌ Failed to export scan results: {e}")
+                print(f"✅ Scan cycle {index.cycles} done in {time.time() - started:.1f}s: "
+                      f"{len(results)} pairs indexed, ❌ {len(failed_pairs)} failed")
+            except Exception as e:
+                print(f"❌ Scan cycle failed: {e}")
+            # Sleep until just after the next candle closes
+            next_close = (time.time() // period + 1) * period + close_delay
+            sleep_for = max(0, next_close - time.time())
+            print(f"⏳ Next scan in {sleep_for / 60:.1f} minutes")
+            time.sleep(sleep_for)
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping service...")
+    finally:
+        server.shutdown()
+
+
+# --- RUN ORCHESTRATION: stages as a DAG so independent I/O overlaps ---
+class StageOutput:
+    """
+    sys.stdout stand-in for concurrently running stages. Streaming threads write whole lines straight
+    through and flush them, so live progress reaches the log without other threads splitting a line;
+    threads running a buffered stage collect their prints to be written later as one block.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        head, newline, self.local.pending = (getattr(self.local, 'pending', '') + text).rpartition('\n')
+        if newline:
+            self._emit(head + newline)
+        return len(text)
+
+    def flush(self):
+        pending = getattr(self.local, 'pending', '')
+        if pending:
+            self.local.pending = ''
+            self._emit(pending)
+
+    def _emit(self, text):
+        with self.lock:
+            self.stream.write(text)
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class RunOrchestrator:
+    """
+    Runs named stages as a DAG. Each stage starts as soon as its dependencies finish and receives
+    their results as keyword arguments, so shared inputs are fetched once and independent I/O overlaps.
+    Stage output streams live line by line; short stages running alongside a long one can be declared
+    buffered, so their prints come out as one block when they finish instead of between progress lines.
+    Stages share the single ccxt exchange, so their network calls go through exchange_call and its
+    thread-safe rate budget.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+        self.errors = {}
+        self.output = None
+
+    def stage(self, name, func, deps=(), buffered=False):
+        """Declare a stage; func is called as func(**{dep: result_of_dep})"""
+        self.stages[name] = {'func': func, 'deps': tuple(deps), 'buffered': buffered}
+
+    def _check_graph(self):
+        """Reject unknown dependencies and cycles before anything runs"""
+        for name, stage in self.stages.items():
+            missing = [dep for dep in stage['deps'] if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage '{name}' depends on unknown stage(s): {', '.join(missing)}")
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle through stage '{name}'")
+            visiting.add(name)
+            for dep in self.stages[name]['deps']:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _run_stage(self, func, kwargs, buffered):
+        """Run one stage; returns (result, buffered output or '')"""
+        buffer = io.StringIO() if buffered else None
+        self.output.local.buffer = buffer
+        try:
+            return func(**kwargs), buffer.getvalue() if buffered else ''
+        except Exception as e:
+            e.stage_output = buffer.getvalue() if buffered else ''
+            raise
+        finally:
+            self.output.local.buffer = None
+            self.output.flush()  # Emit a trailing partial line
+
+    def run(self):
+        """Run all stages; a failed stage skips everything downstream of it. Returns the results."""
+        self._check_graph()
+        self.output = StageOutput(sys.stdout)
+        sys.stdout = self.output
+        try:
+            return self._run_all()
+        finally:
+            self.output.flush()
+            sys.stdout = self.output.stream
+
+    def _run_all(self):
+        run_start = time.time()
+        pending, running = dict(self.stages), {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if any(dep in self.errors for dep in stage['deps']):
+                        self.errors[name] = 'skipped: upstream stage failed'
+                        del pending[name]
+                    elif all(dep in self.results for dep in stage['deps']):
+                        kwargs = {dep: self.results[dep] for dep in stage['deps']}
+                        self.timings[name] = {'start': time.time() - run_start}
+                        running[pool.submit(self._run_stage, stage['func'], kwargs, stage['buffered'])] = name
+                        del pending[name]
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    self.timings[name]['end'] = time.time() - run_start
+                    try:
+                        self.results[name], output = future.result()
+                        print(output, end='')
+                    except Exception as e:
+                        print(getattr(e, 'stage_output', ''), end='')
+                        self.errors[name] = str(e)
+                        print(f"❌ Stage '{name}' failed: {e}")
+        self.wall_time = time.time() - run_start
+        return self.results
+
+    def critical_path(self):
+        """Chain of stages that determined the finish time, found by walking back from the last stage to end"""
+        finished = {name: t for name, t in self.timings.items() if 'end' in t}
+        if not finished:
+            return []
+        name = max(finished, key=lambda n: finished[n]['end'])
+        path = [name]
+        while True:
+            deps = [dep for dep in self.stages[name]['deps'] if dep in finished]
+            if not deps:
+                break
+            name = max(deps, key=lambda n: finished[n]['end'])
+            path.append(name)
+        return list(reversed(path))
+
+    def print_report(self):
+        """Print per-stage timings and the critical path of the last run"""
+        print(f"\n{'=' * 60}")
+        print("⏱️  RUN TIMINGS")
+        print("=" * 60)
+        for name, t in sorted(self.timings.items(), key=lambda item: item[1]['start']):
+            duration = t.get('end', t['start']) - t['start']
+            status = '❌' if name in self.errors else '✅'
+            print(f"   {status} {name:<12} {t['start']:7.2f}s → {t.get('end', t['start']):7.2f}s ({duration:.2f}s)")
+        for name, error in self.errors.items():
+            if name not in self.timings:
+                print(f"   ⏭️  {name:<12} {error}")
+        path = self.critical_path()
+        path_time = sum(self.timings[n]['end'] - self.timings[n]['start'] for n in path)
+        stage_time = sum(t['end'] - t['start'] for t in self.timings.values() if 'end' in t)
+        print(f"\n🧭 Critical path: {' → '.join(path)} ({path_time:.2f}s)")
+        print(f"⚡ Wall time: {self.wall_time:.2f}s vs {stage_time:.2f}s if run serially")
+
+
+def fetch_balance_tickers(balances):
+    """Fetch USDT tickers for every held asset in one batched call"""
+    markets = exchange.load_markets()
+    symbols = [f"{asset}/USDT" for asset in balances if asset != 'USDT' and f"{asset}/USDT" in markets]
+    if not symbols:
+        return {}
+    try:
+        return exchange_call(exchange.fetch_tickers, symbols)
+    except Exception as e:
+        print(f"❌ Batched ticker fetch failed, falling back to per-asset tickers: {e}")
+        return {}
+
+
+def build_run_dag(export_dir=None, export_candles=False, enable_trading=True):
+    """Declare the default cron run: market analysis and wallet data are fetched concurrently"""
+    dag = RunOrchestrator()
+    dag.stage('markets', lambda: exchange_call(exchange.load_markets))
+    # Everything else waits for markets, since ccxt would otherwise load them again in each call
+    # Short stages overlapping the scan are buffered so their output doesn't split its progress log
+    dag.stage('btc', lambda markets: analyze_btc_detailed(), deps=['markets'], buffered=True)
+    dag.stage('balances', lambda markets: get_wallet_balances(), deps=['markets'], buffered=True)
+    dag.stage('tickers', lambda balances, markets: fetch_balance_tickers(balances), deps=['balances', 'markets'],
+              buffered=True)
+
+    def scan(markets):
         print(f"\n{'=' * 70}")
         print("🔎 SCANNING USDT SPOT PAIRS FOR OPPORTUNITIES...")
         print("=" * 70)
-        top_coins = get_best_coins(top_n=15)
-        print_analysis_results(top_coins)
-        get_market_summary(top_coins)
+        # BTC/USDT is analyzed by its own stage and merged back in by 'ranking'
+        return scan_usdt_pairs(skip_pairs=('BTC/USDT',))
+
+    def ranking(scan, btc):
+        all_results, failed_pairs = scan
+        if btc:
+            all_results = all_results + [btc]
+        return rank_scan_results(all_results, failed_pairs, top_n=15, export_dir=export_dir,
+                                 export_candles=export_candles)
+
+    def report(ranking):
+        print_analysis_results(ranking)
+        get_market_summary(ranking)
         print(f"\n{'=' * 70}")
         print("⚡ FULL MARKET ANALYSIS COMPLETE - TRADE RESPONSIBLY!")
         print("💡 Tip: Focus on high-scoring pairs with strong patterns")
         print("=" * 70)
+
+    def rebalance(ranking, balances, tickers, report):
         print(f"\n{'=' * 70}")
         print("🤖 AUTOMATIC WALLET REBALANCING")
         print("=" * 70)
-        auto_rebalance_wallet(existing_analysis=top_coins, min_score_threshold=15, max_positions=3, enable_trading=True)
+        auto_rebalance_wallet(existing_analysis=ranking, min_score_threshold=15, max_positions=3,
+                              enable_trading=enable_trading, balances=balances, tickers=tickers)
+
+    dag.stage('scan', scan, deps=['markets'])
+    dag.stage('ranking', ranking, deps=['scan', 'btc'])
+    dag.stage('report', report, deps=['ranking'])
+    # Also waits for the report so the printed output stays in order
+    dag.stage('rebalance', rebalance, deps=['ranking', 'balances', 'tickers', 'report'])
+    return dag
+
+
+if __name__ == "__main__":
+    if not exchange.apiKey or exchange.apiKey == os.environ['API']:
+        print("⚠️  Please set your Binance API credentials in GitHub Secrets")
+        print("⚠️  The script will try to run with public endpoints only")
+    export_dir = os.environ.get('EXPORT_DIR', DEFAULT_EXPORT_DIR)  # Set to an empty string to disable exports
+    export_candles = os.environ.get('EXPORT_CANDLES', '0') == '1'
+    if '--serve' in sys.argv:
+        run_service(host=os.environ.get('SERVICE_HOST', '127.0.0.1'), port=int(os.environ.get('SERVICE_PORT', 8080)),
+                    export_dir=export_dir, export_candles=export_candles)
+        sys.exit(0)
+    try:
+        run_dag = build_run_dag(export_dir=export_dir, export_candles=export_candles, enable_trading=True)
+        run_dag.run()
+        run_dag.print_report()
         print(f"\n{'=' * 70}")
         print("💡 TO ENABLE REAL TRADING:")
-        print("💡 Set enable_trading=True in the auto_rebalance_wallet() call")
+        print("💡 Set enable_trading=True in the build_run_dag() call")
         print("💡 ALWAYS test with small amounts first!")
         print("=" * 70)
     except Exception as e: